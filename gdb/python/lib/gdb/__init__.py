@@ -13,9 +13,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import atexit
 import signal
 import threading
-import traceback
 import os
 import sys
 import _gdb
@@ -36,7 +36,40 @@ import _gdbevents as events
 sys.modules["gdb.events"] = events
 
 
+# Text written to sys.stdout and sys.stderr that has not been passed
+# to gdb yet, as [stream, text] pairs in the order it was written, and
+# the total length of that text.  GDB calls _flush_buffered_output
+# before it prints anything itself, so that the text comes out in the
+# right order.  Both are kept when GdbSetPythonDirectory reloads this
+# module.  python.c keeps a reference to the list, so it is only ever
+# changed in place.
+_buffered_output = globals().get("_buffered_output", [])
+_buffered_size = globals().get("_buffered_size", 0)
+
+# Text is held back until a newline is written, or this many characters
+# are waiting.
+_BUFFER_SIZE = 4096
+
+if "_flush_buffered_output" not in globals():
+    # GdbSetPythonDirectory reloads this module.  The handler looks the
+    # function up when it runs, so it is only registered once.
+    atexit.register(lambda: _flush_buffered_output())
+
+
+def _flush_buffered_output(_write=_gdb.write):
+    global _buffered_size
+    # Empty the list before writing anything: gdb.write flushes it
+    # first, and would print later text ahead of this.
+    pending = _buffered_output[:]
+    del _buffered_output[:]
+    _buffered_size = 0
+    for stream, text in pending:
+        _write(text, stream)
+
+
 class _GdbFile(object):
+    __slots__ = ("stream",)
+
     # These two are needed in Python 3
     encoding = "UTF-8"
     errors = "strict"
@@ -52,14 +85,29 @@ class _GdbFile(object):
         return False
 
     def writelines(self, iterable):
-        for line in iterable:
-            self.write(line)
+        self.write("".join(iterable))
+
+    # The stream is passed positionally, which is cheaper than a
+    # keyword argument.
 
     def flush(self):
-        flush(stream=self.stream)
+        _flush_buffered_output()
+        flush(self.stream)
 
     def write(self, s):
-        write(s, stream=self.stream)
+        global _buffered_size
+        if not _buffered_output:
+            if "\n" in s:
+                write(s, self.stream)
+                return
+            _buffered_output.append([self.stream, s])
+        elif _buffered_output[-1][0] == self.stream:
+            _buffered_output[-1][1] += s
+        else:
+            _buffered_output.append([self.stream, s])
+        _buffered_size += len(s)
+        if "\n" in s or _buffered_size > _BUFFER_SIZE:
+            _flush_buffered_output()
 
 
 sys.stdout = _GdbFile(STDOUT)
@@ -73,32 +121,92 @@ prompt_hook = None
 # We do not use PySys_SetArgvEx because it did not appear until 2.6.6.
 sys.argv = [""]
 
-# Initial pretty printers.
-try:
-    pretty_printers
-except NameError:
-    pretty_printers = []
 
+def _invalidating(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        _invalidate_unwinder_cache()
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = name
+    return wrapper
+
+
+class _UnwinderList(list):
+    """The type of gdb.frame_unwinders.
+
+    Modifying the list drops the cache of enabled unwinders used by
+    _execute_unwinders."""
+
+    __slots__ = ()
+
+    __setitem__ = _invalidating("__setitem__")
+    __delitem__ = _invalidating("__delitem__")
+    __iadd__ = _invalidating("__iadd__")
+    __imul__ = _invalidating("__imul__")
+    append = _invalidating("append")
+    extend = _invalidating("extend")
+    insert = _invalidating("insert")
+    pop = _invalidating("pop")
+    remove = _invalidating("remove")
+    reverse = _invalidating("reverse")
+    sort = _invalidating("sort")
+    # list.clear is new in Python 3.3.
+    if hasattr(list, "clear"):
+        clear = _invalidating("clear")
+
+
+# The lists below are kept when GdbSetPythonDirectory reloads this
+# module.
+
+# Initial pretty printers.
+pretty_printers = globals().get("pretty_printers", [])
 # Initial type printers.
-try:
-    type_printers
-except NameError:
-    type_printers = []
+type_printers = globals().get("type_printers", [])
 # Initial xmethod matchers.
-try:
-    xmethods
-except NameError:
-    xmethods = []
+xmethods = globals().get("xmethods", [])
 # Initial frame filters.
-try:
-    frame_filters
-except NameError:
-    frame_filters = {}
+frame_filters = globals().get("frame_filters", {})
 # Initial frame unwinders.
-try:
-    frame_unwinders
-except NameError:
-    frame_unwinders = []
+frame_unwinders = globals().get("frame_unwinders", _UnwinderList())
+
+
+# The enabled unwinders, as a tuple of (unwinder, name) pairs in the
+# order _execute_unwinders tries them, and the program space this was
+# computed for.  None means the tuple must be recomputed.
+_unwinder_cache = None
+_unwinder_cache_progspace = None
+
+
+if "_invalidate_unwinder_cache" not in globals():
+    # GdbSetPythonDirectory reloads this module.  The handlers look the
+    # function up when they run, so they are only connected once.
+    events.new_objfile.connect(lambda event: _invalidate_unwinder_cache())
+    events.free_objfile.connect(lambda event: _invalidate_unwinder_cache())
+    events.clear_objfiles.connect(lambda event: _invalidate_unwinder_cache())
+    # GDB discards its own frames when the inferior stops, and frames
+    # are usually unwound again when a command runs, so also forget the
+    # unwinders at those points.  This way changes made to an unwinder
+    # list or to an unwinder's "enabled" attribute by hand still take
+    # effect by the next command.
+    events.stop.connect(lambda event: _invalidate_unwinder_cache())
+    events.before_prompt.connect(lambda: _invalidate_unwinder_cache())
+
+
+def _invalidate_unwinder_cache():
+    global _unwinder_cache
+    _unwinder_cache = None
+
+
+def invalidate_cached_frames():
+    """invalidate_cached_frames () -> None.
+    Invalidate any cached frame objects in gdb.
+    Intended for internal use only."""
+    # Registering, enabling or disabling an unwinder ends up here, so
+    # this is also where the list of enabled unwinders is forgotten.
+    _invalidate_unwinder_cache()
+    _gdb.invalidate_cached_frames()
 
 
 def _execute_unwinders(pending_frame):
@@ -118,28 +226,95 @@ def _execute_unwinders(pending_frame):
 
         or None, if no unwinder has claimed the frame.
     """
-    for objfile in objfiles():
-        for unwinder in objfile.frame_unwinders:
-            if unwinder.enabled:
-                unwind_info = unwinder(pending_frame)
-                if unwind_info is not None:
-                    return (unwind_info, unwinder.name)
-
-    for unwinder in current_progspace().frame_unwinders:
-        if unwinder.enabled:
-            unwind_info = unwinder(pending_frame)
-            if unwind_info is not None:
-                return (unwind_info, unwinder.name)
-
-    for unwinder in frame_unwinders:
-        if unwinder.enabled:
-            unwind_info = unwinder(pending_frame)
-            if unwind_info is not None:
-                return (unwind_info, unwinder.name)
+    global _unwinder_cache, _unwinder_cache_progspace
+
+    progspace = _current_progspace()
+    unwinders = _unwinder_cache
+    if unwinders is None or _unwinder_cache_progspace is not progspace:
+        unwinders = []
+        for objfile in objfiles():
+            unwinders.extend(objfile.frame_unwinders)
+        unwinders.extend(progspace.frame_unwinders)
+        unwinders.extend(frame_unwinders)
+        unwinders = tuple((u, u.name) for u in unwinders if u.enabled)
+        _unwinder_cache = unwinders
+        _unwinder_cache_progspace = progspace
+
+    for unwinder, name in unwinders:
+        unwind_info = unwinder(pending_frame)
+        if unwind_info is not None:
+            return (unwind_info, name)
 
     return None
 
 
+def _compile_file(filepath):
+    """Return the code object for the Python source file FILEPATH.
+
+    Like the import system, this keeps the compiled code in a
+    __pycache__ directory, and reuses it for as long as the source
+    file's modification time and size stay the same.  Any problem
+    with the cache just means the file is compiled again.
+    """
+    import importlib.util
+    import marshal
+    import types
+
+    # importlib.util.MAGIC_NUMBER and cache_from_source are new in
+    # Python 3.4.
+    cache_path = None
+    if sys.version_info >= (3, 4):
+        try:
+            cache_path = importlib.util.cache_from_source(filepath)
+        except NotImplementedError:
+            pass
+
+    if cache_path is not None:
+        st = os.stat(filepath)
+        # The header of a timestamp-based .pyc file, see PEP 552.
+        header = b"".join(
+            (
+                importlib.util.MAGIC_NUMBER,
+                (0).to_bytes(4, "little"),
+                (int(st.st_mtime) & 0xFFFFFFFF).to_bytes(4, "little"),
+                (st.st_size & 0xFFFFFFFF).to_bytes(4, "little"),
+            )
+        )
+        try:
+            with open(cache_path, "rb") as file:
+                data = file.read()
+            if data[:16] == header:
+                compiled = marshal.loads(data[16:])
+                if (
+                    isinstance(compiled, types.CodeType)
+                    and compiled.co_filename == filepath
+                ):
+                    return compiled
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+    # Do not let the __future__ imports of this module leak into the
+    # script.  The optimization level is left as the interpreter's,
+    # which is also what cache_from_source names the cache file after.
+    with open(filepath, "rb") as file:
+        compiled = compile(file.read(), filepath, "exec", dont_inherit=True)
+
+    if cache_path is not None and not sys.dont_write_bytecode:
+        tmp_path = "%s.%d" % (cache_path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(tmp_path, "wb") as file:
+                file.write(header + marshal.dumps(compiled))
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    return compiled
+
+
 def _execute_file(filepath):
     """This function is used to replace Python 2's PyRun_SimpleFile.
 
@@ -157,18 +332,20 @@ def _execute_file(filepath):
         globals["__file__"] = filepath
         set_file = True
     try:
-        with open(filepath, "rb") as file:
-            # We pass globals also as locals to match what Python does
-            # in PyRun_SimpleFile.
-            compiled = compile(file.read(), filepath, "exec")
-            exec(compiled, globals, globals)
+        compiled = _compile_file(filepath)
+        # We pass globals also as locals to match what Python does
+        # in PyRun_SimpleFile.
+        exec(compiled, globals, globals)
     finally:
         if set_file:
             del globals["__file__"]
 
 
+# The directory holding this package.
+_here = os.path.dirname(__file__)
+
 # Convenience variable to GDB's python directory
-PYTHONDIR = os.path.dirname(os.path.dirname(__file__))
+PYTHONDIR = os.path.dirname(_here)
 
 # Auto-load all functions/commands.
 
@@ -176,30 +353,47 @@ PYTHONDIR = os.path.dirname(os.path.dirname(__file__))
 
 packages = ["function", "command", "printer"]
 
-# pkgutil.iter_modules is not available prior to Python 2.6.  Instead,
-# manually iterate the list, collating the Python files in each module
-# path.  Construct the module name, and import.
+# Manually iterate the list, collating the Python files in each module
+# path.  Construct the module name, and import.  The imports are done
+# one at a time on this thread: importing these modules creates
+# commands, functions and parameters, and GDB's API must only be used
+# from GDB's main thread.
 
 
-def _auto_load_packages():
-    for package in packages:
-        location = os.path.join(os.path.dirname(__file__), package)
-        if os.path.exists(location):
-            py_files = filter(
-                lambda x: x.endswith(".py") and x != "__init__.py", os.listdir(location)
-            )
+def _auto_load_module(modname, reload_existing=False):
+    try:
+        module = sys.modules.get(modname) if reload_existing else None
+        if module is not None:
+            # reload modules with duplicate names
+            reload(module)
+        else:
+            __import__(modname)
+    except:
+        # Only imported here, so that a normal startup does not pay for it.
+        import traceback
+
+        sys.stderr.write(traceback.format_exc() + "\n")
 
-            for py_file in py_files:
-                # Construct from foo.py, gdb.module.foo
-                modname = "%s.%s.%s" % (__name__, package, py_file[:-3])
-                try:
-                    if modname in sys.modules:
-                        # reload modules with duplicate names
-                        reload(__import__(modname))
-                    else:
-                        __import__(modname)
-                except:
-                    sys.stderr.write(traceback.format_exc() + "\n")
+
+def _auto_load_packages(reload_existing=False):
+    """Import the modules of the auto-loaded packages.
+
+    If RELOAD_EXISTING is true, modules that have already been imported
+    are reloaded.  This is only needed after GdbSetPythonDirectory."""
+    for package in packages:
+        # A single listdir instead of checking first whether the
+        # directory exists.  os.scandir would not help, as only the
+        # names are needed.
+        try:
+            names = os.listdir(os.path.join(_here, package))
+        except OSError:
+            continue
+        for name in names:
+            if not name.endswith(".py") or name == "__init__.py":
+                continue
+            # Construct from foo.py, gdb.module.foo
+            modname = "%s.%s.%s" % (__name__, package, name[:-3])
+            _auto_load_module(modname, reload_existing)
 
 
 _auto_load_packages()
@@ -220,34 +414,42 @@ def GdbSetPythonDirectory(dir):
     # note that reload overwrites the gdb module without deleting existing
     # attributes
     reload(__import__(__name__))
-    _auto_load_packages()
+    _auto_load_packages(True)
 
 
 def current_progspace():
     "Return the current Progspace."
-    return selected_inferior().progspace
+    # There is no event for the selected inferior changing, so this
+    # cannot be cached; _gdb does the lookup in a single call instead.
+    return _gdb._current_progspace()
+
+
+# The functions below, and _execute_unwinders, are called often, e.g.
+# for every frame a backtrace prints, so they use this instead of
+# calling current_progspace.
+_current_progspace = _gdb._current_progspace
 
 
 def objfiles():
     "Return a sequence of the current program space's objfiles."
-    return current_progspace().objfiles()
+    return _current_progspace().objfiles()
 
 
 def solib_name(addr):
     """solib_name (Long) -> String.\n\
 Return the name of the shared library holding a given address, or None."""
-    return current_progspace().solib_name(addr)
+    return _current_progspace().solib_name(addr)
 
 
 def block_for_pc(pc):
     "Return the block containing the given pc value, or None."
-    return current_progspace().block_for_pc(pc)
+    return _current_progspace().block_for_pc(pc)
 
 
 def find_pc_line(pc):
     """find_pc_line (pc) -> Symtab_and_line.
     Return the gdb.Symtab_and_line object corresponding to the pc value."""
-    return current_progspace().find_pc_line(pc)
+    return _current_progspace().find_pc_line(pc)
 
 
 def set_parameter(name, value):
@@ -262,7 +464,14 @@ def set_parameter(name, value):
             value = "on"
         else:
             value = "off"
-    execute("set " + name + " " + str(value), to_string=True)
+    else:
+        value = str(value)
+    try:
+        _gdb._set_parameter_value(name, value)
+    except NotImplementedError:
+        # Not something gdb knows as a parameter; let the "set"
+        # command sort it out.
+        execute("set " + name + " " + value, to_string=True)
 
 
 @contextmanager
@@ -278,15 +487,24 @@ def with_parameter(name, value):
         set_parameter(name, old_value)
 
 
+# The signals that blocked_signals blocks, or None if this platform
+# does not support that.
+if hasattr(signal, "pthread_sigmask"):
+    _blocked_signals = frozenset(
+        {signal.SIGCHLD, signal.SIGINT, signal.SIGALRM, signal.SIGWINCH}
+    )
+else:
+    _blocked_signals = None
+
+
 @contextmanager
 def blocked_signals():
     """A helper function that blocks and unblocks signals."""
-    if not hasattr(signal, "pthread_sigmask"):
+    if _blocked_signals is None:
         yield
         return
 
-    to_block = {signal.SIGCHLD, signal.SIGINT, signal.SIGALRM, signal.SIGWINCH}
-    old_mask = signal.pthread_sigmask(signal.SIG_BLOCK, to_block)
+    old_mask = signal.pthread_sigmask(signal.SIG_BLOCK, _blocked_signals)
     try:
         yield None
     finally:
@@ -994,6 +994,19 @@ gdbpy_selected_inferior (PyObject *self, PyObject *args)
 	  inferior_to_inferior_object (current_inferior ()).release ());
 }
 
+/* Implementation of gdb._current_progspace () -> gdb.Progspace.  The
+   same as gdb.selected_inferior ().progspace, but without going
+   through the inferior object.  */
+
+PyObject *
+gdbpy_current_progspace (PyObject *self, PyObject *args)
+{
+  program_space *pspace = current_inferior ()->pspace;
+  gdb_assert (pspace != nullptr);
+
+  return pspace_to_pspace_object (pspace).release ();
+}
+
 static int CPYCHECKER_NEGATIVE_RESULT_SETS_EXCEPTION
 gdbpy_initialize_inferior (void)
 {
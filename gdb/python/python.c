@@ -62,6 +62,7 @@ static const char *gdbpy_should_print_stack = python_excp_message;
 #ifdef HAVE_PYTHON
 
 #include "cli/cli-decode.h"
+#include "cli/cli-setshow.h"
 #include "charset.h"
 #include "top.h"
 #include "ui.h"
@@ -233,6 +234,9 @@ gdbpy_enter::~gdbpy_enter ()
       warning (_("internal error: Unhandled Python exception"));
     }
 
+  if (!gdbpy_flush_buffered_output ())
+    gdbpy_print_stack ();
+
   m_error->restore ();
 
   python_gdbarch = m_gdbarch;
@@ -590,6 +594,74 @@ gdbpy_parameter (PyObject *self, PyObject *args)
   return gdbpy_parameter_value (*cmd->var);
 }
 
+/* Implementation of gdb._set_parameter_value.  Set the parameter NAME
+   from the string VALUE, exactly as "set NAME VALUE" would, but
+   without going through the command-line machinery.  Raises
+   NotImplementedError if NAME does not name a parameter, or if the
+   "set" command has hooks or is deprecated, in which case the caller
+   should run the "set" command instead.  Only execute_command runs
+   the hooks and prints the deprecation warning.  */
+
+static PyObject *
+gdbpy_set_parameter_value (PyObject *self, PyObject *args)
+{
+  struct cmd_list_element *alias, *prefix, *cmd;
+  const char *name;
+  const char *value;
+  int found = -1;
+
+  if (! PyArg_ParseTuple (args, "ss", &name, &value))
+    return NULL;
+
+  std::string newarg = std::string ("set ") + name;
+
+  try
+    {
+      found = lookup_cmd_composition (newarg.c_str (), &alias, &prefix, &cmd);
+    }
+  catch (const gdb_exception &ex)
+    {
+      GDB_PY_HANDLE_EXCEPTION (ex);
+    }
+
+  if (!found || cmd == CMD_LIST_AMBIGUOUS || cmd->type != set_cmd
+      || !cmd->var.has_value ())
+    return PyErr_Format (PyExc_NotImplementedError,
+			 _("`%s' is not a parameter."), name);
+
+  if (cmd->hook_pre != nullptr || cmd->hook_post != nullptr
+      || cmd->deprecated_warn_user
+      || (alias != nullptr && alias->deprecated_warn_user)
+      || (prefix != nullptr && prefix->deprecated_warn_user))
+    return PyErr_Format (PyExc_NotImplementedError,
+			 _("`%s' must be set with the \"set\" command."),
+			 name);
+
+  /* Like execute_command, ignore leading spaces and pass a null
+     argument rather than an empty one.  */
+  value = skip_spaces (value);
+  if (*value == '\0')
+    value = nullptr;
+
+  try
+    {
+      /* Discard any output, like gdb.execute with to_string does.  */
+      std::string output;
+      execute_fn_to_string (output,
+			    [&] ()
+			    {
+			      do_set_command (value, 0, cmd);
+			    },
+			    false);
+    }
+  catch (const gdb_exception &ex)
+    {
+      GDB_PY_HANDLE_EXCEPTION (ex);
+    }
+
+  Py_RETURN_NONE;
+}
+
 /* Wrapper for target_charset.  */
 
 static PyObject *
@@ -665,6 +737,9 @@ execute_gdb_command (PyObject *self, PyObject *args, PyObject *kw)
       styled = cmp != 0;
     }
 
+  if (!to_string && !gdbpy_flush_buffered_output ())
+    return NULL;
+
   std::string to_string_res;
 
   scoped_restore preventer = prevent_dont_repeat ();
@@ -1477,6 +1552,47 @@ gdbpy_format_address (PyObject *self, PyObject *args, PyObject *kw)
 
 /* Printing.  */
 
+/* The gdb module's _buffered_output list, once it has been looked up.
+   gdb/__init__.py only ever changes that list in place, so the same
+   object stays valid for as long as Python runs.  */
+
+static PyObject *gdbpy_buffered_output;
+
+/* See python-internal.h.  */
+
+bool
+gdbpy_flush_buffered_output ()
+{
+  if (gdbpy_buffered_output == nullptr)
+    {
+      if (gdb_python_module == nullptr)
+	return true;
+
+      PyObject *output = PyObject_GetAttrString (gdb_python_module,
+						 "_buffered_output");
+      if (output == nullptr)
+	{
+	  PyErr_Clear ();
+	  return true;
+	}
+      if (!PyList_Check (output))
+	{
+	  Py_DECREF (output);
+	  return true;
+	}
+      gdbpy_buffered_output = output;
+    }
+
+  /* This is checked on every return from Python, so only call into
+     Python when some text is actually being held back.  */
+  if (PyList_GET_SIZE (gdbpy_buffered_output) == 0)
+    return true;
+
+  gdbpy_ref<> result (PyObject_CallMethod (gdb_python_module,
+					   "_flush_buffered_output", nullptr));
+  return result != nullptr;
+}
+
 /* A python function to write a single string using gdb's filtered
    output stream .  The optional keyword STREAM can be used to write
    to a particular stream.  The default stream is to gdb_stdout.  */
@@ -1492,6 +1608,9 @@ gdbpy_write (PyObject *self, PyObject *args, PyObject *kw)
 					&stream_type))
     return NULL;
 
+  if (!gdbpy_flush_buffered_output ())
+    return NULL;
+
   try
     {
       switch (stream_type)
@@ -1532,6 +1651,9 @@ gdbpy_flush (PyObject *self, PyObject *args, PyObject *kw)
 					&stream_type))
     return NULL;
 
+  if (!gdbpy_flush_buffered_output ())
+    return NULL;
+
   switch (stream_type)
     {
     case 1:
@@ -2551,6 +2673,10 @@ Evaluate command, a string, as a gdb MI command.\n\
 Arguments (also strings) are passed to the command." },
   { "parameter", gdbpy_parameter, METH_VARARGS,
     "Return a gdb parameter's value" },
+  { "_set_parameter_value", gdbpy_set_parameter_value, METH_VARARGS,
+    "_set_parameter_value (NAME, VALUE) -> None.\n\
+Set gdb parameter NAME from the string VALUE.\n\
+Intended for internal use only." },
 
   { "breakpoints", gdbpy_breakpoints, METH_NOARGS,
     "Return a tuple of all breakpoint objects" },
@@ -2659,6 +2785,10 @@ Return the selected thread object." },
   { "selected_inferior", gdbpy_selected_inferior, METH_NOARGS,
     "selected_inferior () -> gdb.Inferior.\n\
 Return the selected inferior object." },
+  { "_current_progspace", gdbpy_current_progspace, METH_NOARGS,
+    "_current_progspace () -> gdb.Progspace.\n\
+Return the selected inferior's program space.\n\
+Intended for internal use only." },
   { "inferiors", gdbpy_inferiors, METH_NOARGS,
     "inferiors () -> (gdb.Inferior, ...).\n\
 Return a tuple containing all inferiors." },
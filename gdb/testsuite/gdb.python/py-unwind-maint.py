@@ -47,6 +47,15 @@ class TestObjfileUnwinder(Unwinder):
         return None
 
 
+class TestExtraUnwinder(Unwinder):
+    def __init__(self):
+        super(TestExtraUnwinder, self).__init__("extra_unwinder")
+
+    def __call__(self, unwinder_info):
+        print("%s called" % self.name)
+        return None
+
+
 gdb.unwinder.register_unwinder(None, TestGlobalUnwinder())
 saw_runtime_error = False
 try: